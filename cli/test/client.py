@@ -1,20 +1,81 @@
+import requests
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from solana.exceptions import handle_exceptions, SolanaRpcException
+from solana.publickey import PublicKey
 from solana.rpc.api import Client as SolanaClient
-from solana.rpc.commitment import Confirmed
+from solana.rpc.commitment import Processed
+from solana.rpc.providers.http import HTTPProvider
+from solana.rpc.types import DataSliceOpts
 from spl.token.instructions import get_associated_token_address
 
+from utils import RPC_URL
+
+
+@lru_cache(maxsize=1024)
+def _associated_token_address(account, mint):
+    return get_associated_token_address(PublicKey(account), PublicKey(mint))
+
+
+def _ata(account, mint):
+    # PublicKey is not hashable, so the cache is keyed on raw bytes
+    return _associated_token_address(bytes(account), bytes(mint))
+
+
+class SessionHTTPProvider(HTTPProvider):
+    """HTTPProvider that reuses keep-alive connections between requests.
+
+    The stock provider of solana 0.21 calls `requests.post` for every
+    request and therefore performs a new TCP and TLS handshake each time.
+    """
+
+    def __init__(self, endpoint, timeout):
+        super().__init__(endpoint, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @handle_exceptions(SolanaRpcException, requests.exceptions.RequestException)
+    def make_request(self, method, *params):
+        request_kwargs = self._before_request(
+            method=method, params=params, is_async=False)
+        raw_response = self.session.post(**request_kwargs,
+                                         timeout=self.timeout)
+        return self._after_request(raw_response=raw_response, method=method)
+
 
 class Client:
-    def __init__(self):
-        self.client = SolanaClient("https://api.devnet.solana.com")
+    def __init__(self, endpoint=RPC_URL):
+        self.client = SolanaClient(endpoint)
+        self.client._provider = SessionHTTPProvider(
+            self.client._provider.endpoint_uri, self.client._provider.timeout)
 
-    def token_amount(self, account, mint):
-        token_address = get_associated_token_address(account, mint)
+    # The CLI waits for its transactions to be confirmed, so by default the
+    # tests read the latest processed state without waiting for more slots
+    def token_amount(self, account, mint, commitment=Processed):
+        token_address = _ata(account, mint)
         answer = self.client.get_token_account_balance(
-            token_address, Confirmed)
+            token_address, commitment)
         return answer['result']['value']['uiAmount']
 
-    def token_account_exists(self, account, mint):
-        token_address = get_associated_token_address(account, mint)
-        answer = self.client.get_token_account_balance(
-            token_address, Confirmed)
-        return 'result' in answer
+    def token_account_exists(self, account, mint, commitment=Processed):
+        # Only the existence matters, so no account data is requested
+        answer = self.client.get_account_info(
+            _ata(account, mint), commitment, encoding='base64',
+            data_slice=DataSliceOpts(offset=0, length=0))
+        return answer['result']['value'] is not None
+
+    def token_amounts(self, pairs, commitment=Processed):
+        token_addresses = [_ata(account, mint) for account, mint in pairs]
+        answer = self.client.get_multiple_accounts(
+            token_addresses, commitment, encoding='jsonParsed')
+
+        amounts = []
+        for account in answer['result']['value']:
+            if account is None:
+                amounts.append(None)
+                continue
+            token_amount = account['data']['parsed']['info']['tokenAmount']
+            amounts.append(token_amount['uiAmount'])
+        return amounts
@@ -1,20 +1,57 @@
 import os
 import random
+import shlex
 import shutil
 import subprocess
 import sys
 import unittest
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from utils import *
-from client import Client
-
-
-def runCli(args: str):
-    print(f'{EXECUTABLE_NAME} {args}')
+from solana.keypair import Keypair
+from solana.publickey import PublicKey
+from solana.rpc.commitment import Confirmed
 
-    cmd = [str(EXECUTABLE_PATH)] + args.split()
-    output = subprocess.run(cmd, check=False, capture_output=True)
+from client import Client
+from utils import (
+    DEFAULT_KEY_PATH,
+    DEFAULT_MINT_PATH,
+    EXECUTABLE_NAME,
+    EXECUTABLE_PATH,
+    PROJECT_DIR,
+    RECIPIENT_PATH,
+    RPC_URL,
+    START_TEST_VALIDATOR,
+    VALIDATOR_LOG_PATH,
+    WORK_DIR,
+    create_temporary_keypair,
+    default_authority,
+    default_mint_pubkey,
+    get_keypair,
+    get_mint_pubkey,
+    recipient_pubkey,
+    start_test_validator,
+    stop_test_validator,
+)
+
+
+VALIDATOR = None
+
+
+def runCli(args):
+    if isinstance(args, str):
+        args = shlex.split(args)
+    else:
+        args = [str(arg) for arg in args]
+
+    print(f'{EXECUTABLE_NAME} {shlex.join(args)}')
+
+    args = [*args, '--url', RPC_URL]
+
+    cmd = [str(EXECUTABLE_PATH), *args]
+    env = dict(os.environ, HOME=str(WORK_DIR))
+    output = subprocess.run(cmd, check=False, capture_output=True,
+                            cwd=WORK_DIR, env=env)
 
     stdout = output.stdout.decode('UTF-8')
     returncode = output.returncode
@@ -23,12 +60,40 @@ def runCli(args: str):
     return stdout, returncode
 
 
+def setUpModule():
+    manifest_path = PROJECT_DIR / 'cli' / 'Cargo.toml'
+    subprocess.run(['cargo', 'build', '--release',
+                    '--manifest-path', str(manifest_path)],
+                   check=True, cwd=PROJECT_DIR)
+
+    WORK_DIR.mkdir()
+
+    global VALIDATOR
+    if START_TEST_VALIDATOR:
+        # tearDownModule is skipped when setUpModule fails
+        try:
+            VALIDATOR = start_test_validator()
+        except Exception:
+            shutil.rmtree(WORK_DIR, ignore_errors=True)
+            raise
+
+
+def tearDownModule():
+    if VALIDATOR is not None:
+        stop_test_validator(VALIDATOR)
+        VALIDATOR_LOG_PATH.unlink(missing_ok=True)
+
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
 class CliTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = Client()
+
     def setUp(self):
         prefix = str(uuid.uuid4())[:8]
-        self.client = Client()
-        self.keyfile = None
-        self.save_path = PROJECT_DIR / f'{prefix}.mint.pubkey'
+        self.save_path = WORK_DIR / f'{prefix}.mint.pubkey'
 
         if self.save_path.exists():
             print(f'Move or delete {self.save_path}')
@@ -39,13 +104,8 @@ class CliTest(unittest.TestCase):
             sys.exit(1)
 
         if DEFAULT_KEY_PATH.exists():
-            new_keypair_filename = f'{prefix}.id.json'
-            self.keyfile = DEFAULT_KEY_PATH.parent / new_keypair_filename
-
-            if self.keyfile.exists():
-                sys.exit(1)
-
-            shutil.move(DEFAULT_KEY_PATH, self.keyfile)
+            print(f'Move or delete {DEFAULT_KEY_PATH}')
+            sys.exit(1)
 
         create_temporary_keypair()
 
@@ -57,8 +117,8 @@ class CliTest(unittest.TestCase):
             os.remove(self.save_path)
 
         os.remove(DEFAULT_KEY_PATH)
-        if self.keyfile is not None:
-            shutil.move(self.keyfile, DEFAULT_KEY_PATH)
+        get_keypair.cache_clear()
+        get_mint_pubkey.cache_clear()
 
     def test_mint(self):
         balance = 0
@@ -120,19 +180,15 @@ class CliTest(unittest.TestCase):
             self.assertTrue(self.client.token_account_exists(recipient, mint))
             self.assertEqual(code, 0)
 
-        output, _ = runCli('balance')
-        authority_amount = self.client.token_amount(authority, mint)
+        authority_amount, recipient_amount = self.client.token_amounts(
+            [(authority, mint), (recipient, mint)], Confirmed)
         self.assertEqual(authority_amount, balance)
-        self.assertTrue(str(balance) in output)
+        self.assertEqual(recipient_amount, initial_balance - balance)
 
-        output, _ = runCli(f'balance --account {authority}')
-        authority_amount = self.client.token_amount(authority, mint)
-        self.assertEqual(authority_amount, balance)
+        output, _ = runCli('balance')
         self.assertTrue(str(balance) in output)
 
         output, _ = runCli(f'balance --account {recipient}')
-        recipient_amount = self.client.token_amount(recipient, mint)
-        self.assertEqual(recipient_amount, initial_balance - balance)
         self.assertTrue(str(initial_balance - balance) in output)
 
         _, code = runCli(f'transfer {recipient} 0')
@@ -146,21 +202,22 @@ class CliTest(unittest.TestCase):
         total_mint_share = 100
         total_transaction_share = 100
 
-        r_1 = Keypair.generate().public_key
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            r_1, r_2, r_3 = executor.map(
+                lambda _: Keypair.generate().public_key, range(3))
+
         m_1 = random.randint(0, total_mint_share)
         t_1 = random.randint(0, total_transaction_share)
 
         total_mint_share -= m_1
         total_transaction_share -= t_1
 
-        r_2 = Keypair.generate().public_key
         m_2 = random.randint(0, total_mint_share)
         t_2 = random.randint(0, total_transaction_share)
 
         total_mint_share -= m_2
         total_transaction_share -= t_2
 
-        r_3 = Keypair.generate().public_key
         m_3 = total_mint_share
         t_3 = total_transaction_share
 
@@ -171,23 +228,22 @@ class CliTest(unittest.TestCase):
         item = random.random() + random.randint(0, 100)
         world = random.random() + random.randint(0, 100)
 
-        args = '\n\t'.join(("initialize",
-                            f"--character {character}",
-                            f"--emote {emote}",
-                            f"--item {item}",
-                            f"--pet {pet}",
-                            f"--tileset {tileset}",
-                            f"--world {world}",
-                            f"--recipient {r_1}",
-                            f"--mint-share {m_1}",
-                            f"--transaction-share {t_1}",
-                            f"--recipient {r_2}",
-                            f"--mint-share {m_2}",
-                            f"--transaction-share {t_2}",
-                            f"--recipient {r_3}",
-                            f"--mint-share {m_3}",
-                            f"--transaction-share {t_3}"
-                            ))
+        args = ["initialize",
+                "--character", character,
+                "--emote", emote,
+                "--item", item,
+                "--pet", pet,
+                "--tileset", tileset,
+                "--world", world,
+                "--recipient", r_1,
+                "--mint-share", m_1,
+                "--transaction-share", t_1,
+                "--recipient", r_2,
+                "--mint-share", m_2,
+                "--transaction-share", t_2,
+                "--recipient", r_3,
+                "--mint-share", m_3,
+                "--transaction-share", t_3]
 
         _, code = runCli(args)
         self.assertEqual(code, 0)
@@ -202,18 +258,17 @@ class CliTest(unittest.TestCase):
         output, code = runCli(f"mint-nft {nft_type} {name} {uri}")
         self.assertEqual(code, 0)
 
-        client = Client()
         mint_address = PublicKey(output.splitlines()[0].split(': ')[1])
-        self.assertEqual(client.token_amount(
+        self.assertEqual(self.client.token_amount(
             default_authority(), mint_address), 1)
 
         recipient = recipient_pubkey()
         _, code = runCli(
             f"transfer 1 --recipient {recipient} --mint-address {mint_address}")
         self.assertEqual(code, 0)
-        self.assertEqual(client.token_amount(
+        self.assertEqual(self.client.token_amount(
             default_authority(), mint_address), 0)
-        self.assertEqual(client.token_amount(recipient, mint_address), 1)
+        self.assertEqual(self.client.token_amount(recipient, mint_address), 1)
 
     def test_withdraw_ft(self):
         balance = 10000
@@ -227,17 +282,16 @@ class CliTest(unittest.TestCase):
         wallet = PublicKey(output.splitlines()[0].split(': ')[1])
         runCli(f"transfer {balance} --recipient {wallet}")
 
-        client = Client()
         mint = default_mint_pubkey()
         authority = default_authority()
-        self.assertEqual(client.token_amount(wallet, mint), balance)
+        self.assertEqual(self.client.token_amount(wallet, mint), balance)
 
         _, code = runCli(
             f"withdraw-ft {balance} --account {account} --recipient {authority}")
 
         self.assertEqual(code, 0)
-        self.assertEqual(client.token_amount(wallet, mint), 0)
-        self.assertEqual(client.token_amount(authority, mint), balance)
+        self.assertEqual(self.client.token_amount(wallet, mint), 0)
+        self.assertEqual(self.client.token_amount(authority, mint), balance)
 
 
 if __name__ == '__main__':
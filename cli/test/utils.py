@@ -1,4 +1,11 @@
+import atexit
 import json
+import os
+import requests
+import subprocess
+import tempfile
+import time
+from functools import lru_cache
 from pathlib import Path
 from solana.keypair import Keypair
 from solana.publickey import PublicKey
@@ -6,38 +13,64 @@ from solana.publickey import PublicKey
 PROJECT_DIR = Path(__file__).parent.parent.parent
 EXECUTABLE_NAME = 'chill-cli'
 EXECUTABLE_PATH = PROJECT_DIR / 'target' / 'release' / EXECUTABLE_NAME
-DEFAULT_KEY_PATH = Path.home() / '.config' / 'solana' / 'id.json'
-DEFAULT_MINT_PATH = Path.cwd() / 'mint.devnet.pubkey'
+DEPLOY_DIR = PROJECT_DIR / 'target' / 'deploy'
+
+# Each test process (or pytest-xdist worker) runs the CLI with its own HOME
+# and working directory, so default keypairs and mint files never collide.
+# The directory is created by setUpModule in main.py
+WORKER_ID = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+WORK_DIR = Path(tempfile.gettempdir()) / f'chill-cli-{WORKER_ID}-{os.getpid()}'
+# Kept outside WORK_DIR so it survives the cleanup after a failed start
+VALIDATOR_LOG_PATH = WORK_DIR.with_name(f'{WORK_DIR.name}-validator.log')
+
+WORKER_INDEX = int(WORKER_ID[2:]) if WORKER_ID.startswith('gw') else 0
+
+# Unless SOLANA_RPC is set, every process starts its own test validator.
+# The CLI gets the URL explicitly, so it stores mints in 'mint.url.pubkey'
+RPC_PORT = 8899 + 2 * WORKER_INDEX
+FAUCET_PORT = 9900 + WORKER_INDEX
+RPC_URL = os.environ.get('SOLANA_RPC', f'http://127.0.0.1:{RPC_PORT}')
+START_TEST_VALIDATOR = 'SOLANA_RPC' not in os.environ
+
+DEFAULT_KEY_PATH = WORK_DIR / '.config' / 'solana' / 'id.json'
+DEFAULT_MINT_PATH = WORK_DIR / 'mint.url.pubkey'
 
 KEYPAIRS = PROJECT_DIR / 'localnet'
 AUTHORITY_PATH = KEYPAIRS / 'authority.json'
 RECIPIENT_PATH = KEYPAIRS / 'recipient.json'
 TESTMINT_PATH = KEYPAIRS / 'mint.pubkey.localnet'
 
+NFT_PROGRAM_ID = '4xCEF9AVXzVXpEyG6BGp4MKisnSmKBrNDSyBduTrfoHC'
+WALLET_PROGRAM_ID = 'FSo9ozLkvW6HTCJ9XfK4eiBWkLCUcmiQ6F1d2kjtJf2Y'
+METADATA_PROGRAM_ID = 'metaqbxxUerdq28cj1RbAWkYQm3ybzjb6a8bt518x1s'
+BPF_LOADER_UPGRADEABLE_ID = 'BPFLoaderUpgradeab1e11111111111111111111111'
 
+
+@lru_cache(maxsize=None)
 def get_mint_pubkey(path):
     with open(path, 'r', encoding='UTF-8') as file:
         pubkey = file.read()
         return PublicKey(pubkey)
 
 
+@lru_cache(maxsize=None)
 def get_keypair(path):
     with open(path, 'r', encoding='UTF-8') as file:
         keypair = json.load(file)
-        keypair = bytes([int(i) for i in keypair])
+        keypair = bytes(keypair)
         return Keypair.from_secret_key(keypair)
 
 
 def create_temporary_keypair():
     keypair = Keypair.generate()
     keypair_bytes = [int(b) for b in keypair.secret_key]
+    DEFAULT_KEY_PATH.parent.mkdir(parents=True, exist_ok=True)
     with open(DEFAULT_KEY_PATH, 'x', encoding='UTF-8') as file:
         json.dump(keypair_bytes, file)
 
 
 def default_authority():
-    path = Path.home() / '.config' / 'solana' / 'id.json'
-    return get_keypair(path).public_key
+    return get_keypair(DEFAULT_KEY_PATH).public_key
 
 
 def default_mint_pubkey():
@@ -45,12 +78,70 @@ def default_mint_pubkey():
 
 
 def authority():
-    return get_keypair(AUTHORITY_PATH).public_key
+    return AUTHORITY_PUBKEY
 
 
 def recipient_pubkey():
-    return get_keypair(RECIPIENT_PATH).public_key
+    return RECIPIENT_PUBKEY
 
 
 def testmint_pubkey():
     return get_mint_pubkey(TESTMINT_PATH)
+
+
+def _pubkey_of_keypair_file(path):
+    return get_keypair(path).public_key if path.exists() else None
+
+
+# The localnet keypairs never change, so their pubkeys are derived only once
+AUTHORITY_PUBKEY = _pubkey_of_keypair_file(AUTHORITY_PATH)
+RECIPIENT_PUBKEY = _pubkey_of_keypair_file(RECIPIENT_PATH)
+
+
+def program_data_address(program_id):
+    # Code of an upgradeable program lives in a separate programdata account
+    address, _ = PublicKey.find_program_address(
+        [bytes(PublicKey(program_id))], PublicKey(BPF_LOADER_UPGRADEABLE_ID))
+    return str(address)
+
+
+def start_test_validator(timeout=60):
+    cmd = ['solana-test-validator', '--reset', '--quiet',
+           '--ledger', str(WORK_DIR / 'test-ledger'),
+           '--rpc-port', str(RPC_PORT),
+           '--faucet-port', str(FAUCET_PORT),
+           '--bpf-program', NFT_PROGRAM_ID,
+           str(DEPLOY_DIR / 'chill_nft.so'),
+           '--bpf-program', WALLET_PROGRAM_ID,
+           str(DEPLOY_DIR / 'chill_wallet.so'),
+           '--url', 'https://api.mainnet-beta.solana.com',
+           '--clone', METADATA_PROGRAM_ID,
+           '--clone', program_data_address(METADATA_PROGRAM_ID)]
+
+    with open(VALIDATOR_LOG_PATH, 'wb') as log:
+        validator = subprocess.Popen(cmd, stdout=log,
+                                     stderr=subprocess.STDOUT)
+    atexit.register(stop_test_validator, validator)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if validator.poll() is not None:
+            raise RuntimeError('solana-test-validator exited with code '
+                               f'{validator.returncode}, '
+                               f'see {VALIDATOR_LOG_PATH}')
+        try:
+            if requests.get(f'{RPC_URL}/health', timeout=1).text == 'ok':
+                return validator
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+
+    stop_test_validator(validator)
+    raise RuntimeError(f'solana-test-validator is not healthy at {RPC_URL}, '
+                       f'see {VALIDATOR_LOG_PATH}')
+
+
+def stop_test_validator(validator):
+    if validator.poll() is None:
+        validator.terminate()
+        validator.wait()